@@ -7,12 +7,143 @@ Provides a menu-driven interface for flashing MicroPython to ESP32 devices
 import os
 import sys
 import subprocess
-import json
-import requests
 import time
-import glob
+import re
+import io
+import contextlib
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+# USB vendor IDs of the USB-to-UART bridges found on ESP32 boards, plus Espressif's native USB
+ESP32_USB_VIDS = {
+    0x10C4,  # Silicon Labs CP210x
+    0x1A86,  # WCH CH340/CH343
+    0x0403,  # FTDI
+    0x303A,  # Espressif (USB-Serial/JTAG and USB-OTG)
+}
+
+# Port names that can be a USB-attached ESP32 (macOS cu.* callout devices as reported by
+# pyserial, Linux ttyUSB*/ttyACM*), used when a port has no USB descriptor to filter on
+USB_SERIAL_PORT_RE = re.compile(r'^(cu\.(usbmodem|usbserial|SLAB|wchusbserial)|tty(USB|ACM)\d+$)', re.IGNORECASE)
+
+# Seconds to wait after ESC for the rest of an arrow key sequence before treating it as a bare ESC
+ESCAPE_SEQUENCE_TIMEOUT = 0.05
+
+# Menu separators and footers, built once rather than on every redraw
+BAR60 = '=' * 60
+BAR80 = '=' * 80
+DASH76 = '-' * 76
+MENU_HINT = "  Use ↑/↓ arrows to navigate, Enter to select, 'q' to quit"
+MENU_FOOTER_60 = ("", BAR60, MENU_HINT, BAR60)
+MENU_FOOTER_80 = ("", BAR80, MENU_HINT, BAR80)
+
+# Device model -> display label for the ESP32 variants with their own firmware builds
+ESP32_VARIANTS = {'esp32c3': 'ESP32-C3', 'esp32s3': 'ESP32-S3', 'esp32c6': 'ESP32-C6'}
+
+# esptool connection attempts per port probe (esptool's own default is 7). Keeps a
+# non-ESP device on a bridge chip from holding up detection for long
+PROBE_CONNECT_ATTEMPTS = 3
+
+# Seconds to wait for the REPL to answer the firmware detection commands
+FIRMWARE_DETECT_TIMEOUT = 2.0
+
+# REPL payload for firmware detection: Ctrl+C stops any running program, then one print()
+# reports version, implementation and platform. The tag is split in the source so the
+# REPL's echo of the command line can't be mistaken for its output.
+FIRMWARE_PROBE = b'\x03\r\nimport sys\r\nprint("MP" "PROBE", sys.version, repr(sys.implementation), sys.platform, sep="|")\r\n'
+FIRMWARE_PROBE_TAG = b'MPPROBE'
+FIRMWARE_PROBE_RE = re.compile(FIRMWARE_PROBE_TAG + rb'\|([^|\r\n]*)\|([^|\r\n]*)\|([^|\r\n]*)\r?\n')
+
+# Firmware signatures looked for in the detection output, all matched in a single pass
+FIRMWARE_SIGNATURE_RE = re.compile(rb'micropython|esp-idf|esp32|arduino', re.IGNORECASE)
+FIRMWARE_BANNER_RE = re.compile(rb'MicroPython v[^\r\n]*')
+
+# Upper bound on bytes read while waiting for the probe, in case the device is streaming output
+FIRMWARE_DETECT_MAX_BYTES = 8192
+
+# MicroPython release offered for download, and the (build date, label) builds listed in the menu
+MICROPYTHON_VERSION = 'v1.26.1'
+FIRMWARE_BUILDS = [
+    ('20250911', 'Latest Stable'),
+    ('20241220', 'Previous Stable'),
+    ('20250911', 'Development'),
+]
+
+# Device model -> suffix of its ESP32_GENERIC firmware board name (generic ESP32 has none)
+FIRMWARE_BOARD_SUFFIXES = {'esp32c3': '_C3', 'esp32s3': '_S3', 'esp32c6': '_C6'}
+
+# Post-flash connection test. The greeting is split in the command so the REPL's echo of it
+# can't be mistaken for the reply
+CONNECTION_TEST_COMMAND = b'\r\nprint("Hello " "MicroPython!")\r\n'
+CONNECTION_TEST_REPLY = b'Hello MicroPython!'
+CONNECTION_TEST_TIMEOUT = 3
+
+# Seconds to wait for the REPL prompt after flashing - first boot also creates the filesystem
+CONNECTION_TEST_BOOT_TIMEOUT = 10
+
+REPL_PROMPT = b'>>> '
+
+# Bytes read per chunk when streaming firmware downloads to disk
+DOWNLOAD_CHUNK_SIZE = 65536
+
+_esptool_api = None
+
+def _load_esptool_api():
+    """Import detect_chip and FatalError from the installed esptool package
+    
+    This script is itself named esptool.py, so a plain `import esptool` from its
+    directory would resolve back to this file instead of the real package.
+    """
+    global _esptool_api
+    
+    if _esptool_api is None:
+        this_file = os.path.abspath(__file__)
+        script_dir = os.path.dirname(this_file)
+        
+        # Drop this script if it was already imported under the package name
+        shadow = sys.modules.get('esptool')
+        if shadow is not None and os.path.abspath(getattr(shadow, '__file__', '') or '') == this_file:
+            del sys.modules['esptool']
+        
+        saved_path = sys.path[:]
+        sys.path[:] = [p for p in sys.path if os.path.abspath(p or os.curdir) != script_dir]
+        try:
+            from esptool import FatalError
+            from esptool.cmds import detect_chip
+        finally:
+            sys.path[:] = saved_path
+        
+        _esptool_api = (detect_chip, FatalError)
+    
+    return _esptool_api
+
+def find_esp32_variant(text):
+    """Return the ESP32_VARIANTS model named in text, or 'esp32' for the generic chip"""
+    normalized = text.lower().replace('-', '')
+    return next((model for model in ESP32_VARIANTS if model in normalized), 'esp32')
+
+def wait_for_repl(ser, timeout):
+    """Nudge the REPL with a newline and read up to its prompt, returning the bytes read
+    
+    Covers boards that are still booting, e.g. because opening the port reset them.
+    """
+    saved_timeout = ser.timeout
+    ser.timeout = timeout
+    try:
+        ser.write(b'\r\n')
+        return ser.read_until(REPL_PROMPT, size=FIRMWARE_DETECT_MAX_BYTES)
+    finally:
+        ser.timeout = saved_timeout
+
+def print_progress(downloaded, total):
+    """Print an in-place download progress line"""
+    if total:
+        percent = downloaded * 100 // total
+        print(f"\r   {downloaded // 1024} KB / {total // 1024} KB ({percent}%)", end='', flush=True)
+    else:
+        print(f"\r   {downloaded // 1024} KB", end='', flush=True)
+
 # Check if required packages are installed
 def check_dependencies():
     """Check and install required dependencies"""
@@ -20,9 +151,8 @@ def check_dependencies():
     missing_packages = []
     
     for package in required_packages:
-        try:
-            __import__(package)
-        except ImportError:
+        # Only locate the package - importing it here would undo the lazy imports elsewhere
+        if importlib.util.find_spec(package) is None:
             missing_packages.append(package)
     
     if missing_packages:
@@ -32,6 +162,43 @@ def check_dependencies():
             subprocess.run([sys.executable, '-m', 'pip', 'install', package], check=True)
         print("✅ Dependencies installed successfully!")
 
+@contextlib.contextmanager
+def raw_mode(fd):
+    """Put the terminal in raw mode for the duration of the block"""
+    import tty
+    import termios
+    
+    try:
+        old_settings = termios.tcgetattr(fd)
+        tty.setraw(fd)
+    except termios.error as e:
+        # termios.error is not an OSError; re-raise as one so callers fall back to number entry
+        raise OSError(*e.args) from e
+    try:
+        yield
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
+
+def read_keys():
+    """Yield keypresses from stdin, staying in raw mode until the generator is closed"""
+    import select
+    
+    fd = sys.stdin.fileno()
+    with raw_mode(fd):
+        while True:
+            # Read the file descriptor directly so select() sees every pending byte
+            data = os.read(fd, 1)
+            if not data:
+                return  # stdin closed
+            ch = data.decode('utf-8', errors='ignore')
+            
+            if ch == '\x1b':  # ESC sequence, or a bare ESC if nothing follows quickly
+                ready, _, _ = select.select([fd], [], [], ESCAPE_SEQUENCE_TIMEOUT)
+                if ready:
+                    ch += os.read(fd, 2).decode('utf-8', errors='ignore')
+            
+            yield ch
+
 class MenuSelector:
     """Interactive menu selector with arrow key navigation"""
     
@@ -40,79 +207,85 @@ class MenuSelector:
         self.items = []
         self.title = ""
     
+    def draw_options(self, items, current_index, footer_lines, redraw=False):
+        """Print the option list and footer, overwriting the previous copy when redrawing"""
+        lines = [f"  ▶ {item}" if i == current_index else f"    {item}" for i, item in enumerate(items)]
+        lines += footer_lines
+        
+        if redraw:
+            # Move back up to the first option line and rewrite only the menu block,
+            # instead of clearing and reprinting the whole screen
+            sys.stdout.write(f"\x1b[{len(lines)}A")
+            sys.stdout.write(''.join(f"\x1b[2K{line}\r\n" for line in lines))
+        else:
+            sys.stdout.write(''.join(f"{line}\r\n" for line in lines))
+        sys.stdout.flush()
+    
+    def select_option(self, items, current_index, footer_lines):
+        """Draw the options and let the user pick one with the arrow keys
+        
+        Returns the selected index, or None if the user quit or stdin closed. Raises ImportError
+        (no termios, e.g. Windows) or OSError (stdin is not a terminal) when arrow key input
+        is not available.
+        """
+        self.draw_options(items, current_index, footer_lines)
+        
+        with contextlib.closing(read_keys()) as keys:
+            for ch in keys:
+                if ch in ('\x1b[A', '\x1bOA'):  # Up arrow
+                    current_index = (current_index - 1) % len(items)
+                elif ch in ('\x1b[B', '\x1bOB'):  # Down arrow
+                    current_index = (current_index + 1) % len(items)
+                elif ch == '\r' or ch == '\n':  # Enter
+                    return current_index
+                elif ch in ('q', '\x03', '\x1b'):  # 'q', Ctrl+C or ESC
+                    return None
+                else:
+                    continue
+                
+                self.draw_options(items, current_index, footer_lines, redraw=True)
+    
     def display_menu(self, title, items, current_index=0):
         """Display interactive menu"""
         self.title = title
         self.items = items
         self.current_index = current_index
         
-        while True:
-            # Clear screen
-            os.system('clear' if os.name == 'posix' else 'cls')
-            
-            print(f"\n{'='*60}")
-            print(f"  {title}")
-            print(f"{'='*60}")
-            
+        # Clear screen and print the title once; keypresses only redraw the options
+        os.system('clear' if os.name == 'posix' else 'cls')
+        
+        header = f"\n{BAR60}\n  {title}\n{BAR60}"
+        print(header)
+        
+        # Get user input
+        try:
+            selected_index = self.select_option(items, current_index, MENU_FOOTER_60)
+            if selected_index is None:  # 'q' or Ctrl+C
+                print("\nExiting...")
+                sys.exit(0)
+            return selected_index
+            
+        except (ImportError, OSError):
+            # Fallback for systems without termios
+            print("\nArrow key navigation not available. Using number selection:")
             for i, item in enumerate(items):
-                if i == current_index:
-                    print(f"  ▶ {item}")
-                else:
-                    print(f"    {item}")
-            
-            print(f"\n{'='*60}")
-            print("  Use ↑/↓ arrows to navigate, Enter to select, 'q' to quit")
-            print(f"{'='*60}")
+                print(f"  {i+1}. {item}")
             
-            # Get user input
-            try:
-                import tty
-                import termios
-                
-                fd = sys.stdin.fileno()
-                old_settings = termios.tcgetattr(fd)
-                
+            while True:
                 try:
-                    tty.setraw(sys.stdin.fileno())
-                    ch = sys.stdin.read(1)
-                    
-                    if ch == '\x1b':  # ESC sequence
-                        ch += sys.stdin.read(2)
-                    
-                finally:
-                    termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
-                
-                if ch == '\x1b[A':  # Up arrow
-                    current_index = (current_index - 1) % len(items)
-                elif ch == '\x1b[B':  # Down arrow
-                    current_index = (current_index + 1) % len(items)
-                elif ch == '\r' or ch == '\n':  # Enter
-                    return current_index
-                elif ch == 'q' or ch == '\x03':  # 'q' or Ctrl+C
+                    choice = input(f"\nSelect option (1-{len(items)}, 'q' to quit): ").strip()
+                    if choice.lower() == 'q':
+                        sys.exit(0)
+                    choice_num = int(choice) - 1
+                    if 0 <= choice_num < len(items):
+                        return choice_num
+                    else:
+                        print(f"Please enter a number between 1 and {len(items)}")
+                except ValueError:
+                    print("Please enter a valid number")
+                except KeyboardInterrupt:
                     print("\nExiting...")
                     sys.exit(0)
-                    
-            except (ImportError, OSError):
-                # Fallback for systems without termios
-                print("\nArrow key navigation not available. Using number selection:")
-                for i, item in enumerate(items):
-                    print(f"  {i+1}. {item}")
-                
-                while True:
-                    try:
-                        choice = input(f"\nSelect option (1-{len(items)}, 'q' to quit): ").strip()
-                        if choice.lower() == 'q':
-                            sys.exit(0)
-                        choice_num = int(choice) - 1
-                        if 0 <= choice_num < len(items):
-                            return choice_num
-                        else:
-                            print(f"Please enter a number between 1 and {len(items)}")
-                    except ValueError:
-                        print("Please enter a valid number")
-                    except KeyboardInterrupt:
-                        print("\nExiting...")
-                        sys.exit(0)
 
 class ESPToolManager:
     """Main ESP32 flashing manager"""
@@ -132,9 +305,9 @@ class ESPToolManager:
     
     def check_conda_environment(self):
         """Check if user is in a conda environment and provide setup instructions if not"""
-        print("\n" + "="*60)
+        print(f"\n{BAR60}")
         print("  🐍 ARE YOU DOING THIS IN A CONDA ENVIRONMENT? 🐍")
-        print("="*60)
+        print(BAR60)
         
         # Check if we're in a conda environment
         conda_env = os.environ.get('CONDA_DEFAULT_ENV')
@@ -176,81 +349,109 @@ class ESPToolManager:
                 print("📝 Copy and paste the commands above to get started.")
                 return False
     
+    def _probe_port(self, port):
+        """Run the esptool chip handshake on a port, returning (port, device_info) or None"""
+        import serial
+        
+        detect_chip, FatalError = _load_esptool_api()
+        try:
+            chip = detect_chip(port, 115200, connect_attempts=PROBE_CONNECT_ATTEMPTS)
+        except (FatalError, serial.SerialException, OSError):
+            # Port exists but might not be ESP32 or not responding
+            return None
+        
+        chip_name = chip.CHIP_NAME
+        try:
+            # Reset out of the ROM bootloader so the firmware runs again, like `esptool chip-id` does
+            chip.hard_reset()
+        except (FatalError, serial.SerialException, OSError):
+            # The chip was still identified; a failed reset only leaves it in download mode
+            pass
+        finally:
+            chip._port.close()
+        
+        # Parse chip type from the detected chip name
+        if 'esp32' not in chip_name.lower():
+            return port, f"{port} (ESP32 - Unknown variant)"
+        return port, f"{port} ({ESP32_VARIANTS.get(find_esp32_variant(chip_name), 'ESP32')})"
+    
+    def _list_candidate_ports(self):
+        """List serial ports worth probing, filtered by USB vendor ID without opening any port"""
+        from serial.tools import list_ports
+        
+        ports = []
+        for port_info in list_ports.comports():
+            if port_info.vid is not None:
+                # USB device - only known ESP32 bridge chips and Espressif's native USB
+                if port_info.vid in ESP32_USB_VIDS:
+                    ports.append(port_info.device)
+            elif os.name != 'posix' or USB_SERIAL_PORT_RE.match(os.path.basename(port_info.device)):
+                # No USB descriptor available - fall back to matching the port name
+                ports.append(port_info.device)
+        
+        return ports
+    
     def detect_esp32_devices(self):
         """Detect connected ESP32 devices"""
         print("\n🔍 Detecting ESP32 devices...")
         
-        # Get list of serial ports
-        if os.name == 'posix':  # macOS/Linux
-            ports = glob.glob('/dev/tty.*')
-        else:  # Windows
-            ports = glob.glob('COM*')
+        # Get list of serial ports that could be an ESP32
+        ports = self._list_candidate_ports()
         
         esp32_ports = []
         device_info = []
         
-        for port in ports:
-            # Skip non-ESP32 ports (but allow usbmodem as that's common for ESP32)
-            if any(skip in port.lower() for skip in ['bluetooth', 'debug']) and 'usbmodem' not in port.lower():
-                continue
-            
-            # Try to detect ESP32 chip
-            try:
-                result = subprocess.run([
-                    'esptool', '--port', port, 'chip-id'
-                ], capture_output=True, text=True, timeout=10)
-                
-                if result.returncode == 0:
-                    esp32_ports.append(port)
-                    # Parse chip type from output
-                    output = result.stdout.lower()
-                    if 'esp32-c3' in output or 'esp32c3' in output:
-                        device_info.append(f"{port} (ESP32-C3)")
-                    elif 'esp32-s3' in output or 'esp32s3' in output:
-                        device_info.append(f"{port} (ESP32-S3)")
-                    elif 'esp32-c6' in output or 'esp32c6' in output:
-                        device_info.append(f"{port} (ESP32-C6)")
-                    elif 'esp32' in output and 'esp32-c3' not in output and 'esp32-s3' not in output and 'esp32-c6' not in output:
-                        device_info.append(f"{port} (ESP32)")
-                    else:
-                        device_info.append(f"{port} (ESP32 - Unknown variant)")
-                        
-            except (subprocess.TimeoutExpired, subprocess.CalledProcessError):
-                # Port exists but might not be ESP32 or not responding
-                continue
-        
-        if not esp32_ports:
+        # Probe ports in parallel - each probe is an independent serial handshake
+        results = []
+        if ports:
+            # Import once up front so the worker threads don't race on sys.path
+            _load_esptool_api()
+            # esptool reports connection progress on stdout; keep it out of the menu.
+            # Leaving the executor block waits for every probe, so none can print
+            # after stdout is restored or overlap a rescan of the same port
+            with contextlib.redirect_stdout(io.StringIO()):
+                with ThreadPoolExecutor(max_workers=min(8, len(ports))) as executor:
+                    futures = {executor.submit(self._probe_port, port): port for port in ports}
+                    for future in as_completed(futures):
+                        result = future.result()
+                        if result is not None:
+                            results.append(result)
+        
+        # Keep the menu order stable regardless of which probe finished first
+        for port, info in sorted(results):
+            esp32_ports.append(port)
+            device_info.append(info)
+        
+        if esp32_ports:
+            print(f"📋 Found {len(esp32_ports)} ESP32 device(s)")
+            menu_title = "Select ESP32 Device"
+        else:
             print("❌ No ESP32 devices detected!")
             print("Make sure your ESP32 is connected via USB and try again.")
-            return False
+            menu_title = "No ESP32 devices detected - connect your ESP32 via USB and rescan"
         
-        print(f"📋 Found {len(esp32_ports)} ESP32 device(s)")
-        
-        # Add manual port entry option
+        # Add rescan and manual port entry options
+        device_info.append("🔄 Rescan devices")
         device_info.append("➕ Enter port manually")
         
         selected_index = self.menu.display_menu(
-            "Select ESP32 Device", 
+            menu_title, 
             device_info
         )
         
-        if selected_index == len(device_info) - 1:
+        if selected_index == len(device_info) - 2:
+            # Rescan - handshake every port again
+            return self.detect_esp32_devices()
+        elif selected_index == len(device_info) - 1:
             # Manual port entry
-            self.device_port = input("Enter device port (e.g., /dev/tty.usbmodem114301): ").strip()
+            self.device_port = input("Enter device port (e.g., /dev/cu.usbmodem114301, /dev/ttyACM0, COM3): ").strip()
             self.device_model = input("Enter device model (esp32, esp32c3, esp32s3, esp32c6): ").strip().lower()
         else:
             # Extract port and model from selection
             selected_device = device_info[selected_index]
             self.device_port = selected_device.split(' (')[0]
             model_part = selected_device.split(' (')[1].rstrip(')')
-            if 'esp32-c3' in model_part.lower() or 'esp32c3' in model_part.lower():
-                self.device_model = 'esp32c3'
-            elif 'esp32-s3' in model_part.lower() or 'esp32s3' in model_part.lower():
-                self.device_model = 'esp32s3'
-            elif 'esp32-c6' in model_part.lower() or 'esp32c6' in model_part.lower():
-                self.device_model = 'esp32c6'
-            else:
-                self.device_model = 'esp32'
+            self.device_model = find_esp32_variant(model_part)
         
         print(f"✅ Selected device: {self.device_port} ({self.device_model})")
         
@@ -275,23 +476,12 @@ class ESPToolManager:
         try:
             # Try to connect and get firmware info
             import serial
-            import time
             
-            ser = serial.Serial(self.device_port, 115200, timeout=3)
-            time.sleep(2)  # Wait for connection to stabilize
+            ser = serial.Serial(self.device_port, 115200, timeout=FIRMWARE_DETECT_TIMEOUT)
             
             # Clear any existing data
             ser.reset_input_buffer()
             
-            # Send commands to detect firmware
-            detection_commands = [
-                b'\r\n',  # Get prompt
-                b'import sys\r\n',  # Import sys module
-                b'print(sys.version)\r\n',  # Get version info
-                b'print(sys.implementation)\r\n',  # Get implementation details
-                b'print(sys.platform)\r\n',  # Get platform info
-            ]
-            
             firmware_info = {
                 'is_micropython': False,
                 'version': 'Unknown',
@@ -300,35 +490,48 @@ class ESPToolManager:
                 'raw_output': ''
             }
             
-            for cmd in detection_commands:
-                ser.write(cmd)
-                time.sleep(0.5)
-                response = ser.read_all().decode('utf-8', errors='ignore')
-                firmware_info['raw_output'] += response
+            # Make sure the REPL is ready first - opening the port may have reset the board.
+            # Keep what was read, since a boot banner also identifies the firmware
+            response = wait_for_repl(ser, FIRMWARE_DETECT_TIMEOUT)
+            
+            # Send the whole detection probe in a single write
+            ser.write(FIRMWARE_PROBE)
+            
+            # Block until the tag, then until the prompt that follows the probe's output line.
+            # read_until returns as soon as the bytes arrive, or at the port timeout
+            response += ser.read_until(FIRMWARE_PROBE_TAG, size=FIRMWARE_DETECT_MAX_BYTES)
+            if response.endswith(FIRMWARE_PROBE_TAG):
+                response += ser.read_until(REPL_PROMPT, size=FIRMWARE_DETECT_MAX_BYTES)
             
             ser.close()
+            firmware_info['raw_output'] = response.decode('utf-8', errors='ignore')
             
-            # Parse the response to determine firmware type
-            output_lower = firmware_info['raw_output'].lower()
+            # Parse the response to determine firmware type - one pass over the raw bytes
+            signatures = {m.group().lower() for m in FIRMWARE_SIGNATURE_RE.finditer(response)}
             
-            if 'micropython' in output_lower:
+            if b'micropython' in signatures:
                 firmware_info['is_micropython'] = True
                 
-                # Extract version information
-                lines = firmware_info['raw_output'].split('\n')
-                for line in lines:
-                    if 'micropython' in line.lower() and 'version' in line.lower():
-                        firmware_info['version'] = line.strip()
-                    elif 'implementation' in line.lower():
-                        firmware_info['implementation'] = line.strip()
-                    elif 'platform' in line.lower():
-                        firmware_info['platform'] = line.strip()
+                # Extract version information from the probe's output line
+                match = FIRMWARE_PROBE_RE.search(response)
+                if match:
+                    version, implementation, platform = (
+                        field.decode('utf-8', errors='ignore').strip() for field in match.groups()
+                    )
+                    firmware_info['version'] = version
+                    firmware_info['implementation'] = implementation
+                    firmware_info['platform'] = platform
+                else:
+                    # No probe reply, but the boot banner may still name the version
+                    banner = FIRMWARE_BANNER_RE.search(response)
+                    if banner:
+                        firmware_info['version'] = banner.group().decode('utf-8', errors='ignore').strip()
                         
-            elif 'esp32' in output_lower or 'esp-idf' in output_lower:
+            elif b'esp32' in signatures or b'esp-idf' in signatures:
                 firmware_info['is_micropython'] = False
                 firmware_info['version'] = 'ESP-IDF or other ESP32 firmware'
                 
-            elif 'arduino' in output_lower:
+            elif b'arduino' in signatures:
                 firmware_info['is_micropython'] = False
                 firmware_info['version'] = 'Arduino firmware'
                 
@@ -354,137 +557,131 @@ class ESPToolManager:
             "No, keep the current firmware"
         ]
         
-        current_index = 0
+        # Clear screen and show persistent information once; keypresses only redraw the options
+        os.system('clear' if os.name == 'posix' else 'cls')
         
-        while True:
-            # Clear screen and show persistent information
-            os.system('clear' if os.name == 'posix' else 'cls')
-            
-            print(f"\n{'='*80}")
-            print(f"  📋 CURRENT FIRMWARE DETECTION RESULTS")
-            print(f"{'='*80}")
-            print(f"  • Firmware Type: {'MicroPython' if firmware_info['is_micropython'] else 'Other'}")
-            print(f"  • Version: {firmware_info['version']}")
-            print(f"  • Platform: {firmware_info['platform']}")
-            
-            if firmware_info['is_micropython']:
-                print(f"\n  ⚠️  MicroPython is already installed on this device!")
-                print(f"     This will overwrite your existing MicroPython installation.")
-                print(f"     Any files or programs stored on the device will be lost.")
-            else:
-                print(f"\n  ⚠️  Non-MicroPython firmware detected!")
-                print(f"     This will replace the current firmware with MicroPython.")
-                print(f"     Any existing programs or data will be lost.")
-            
-            print(f"\n  🔧 Raw Detection Output:")
-            print(f"  {'-'*76}")
-            # Format the raw output with proper indentation
-            formatted_output = firmware_info['raw_output'].replace('\n', '\n  ')
-            print(f"  {formatted_output}")
-            print(f"  {'-'*76}")
-            
-            print(f"\n{'='*80}")
-            print(f"  Do you want to overwrite the current firmware?")
-            print(f"{'='*80}")
-            
-            # Display menu options with selection indicator
-            for i, option in enumerate(options):
-                if i == current_index:
-                    print(f"  ▶ {option}")
-                else:
-                    print(f"    {option}")
-            
-            print(f"\n{'='*80}")
-            print(f"  Use ↑/↓ arrows to navigate, Enter to select, 'q' to quit")
-            print(f"{'='*80}")
-            
-            # Get user input
-            try:
-                import tty
-                import termios
-                
-                fd = sys.stdin.fileno()
-                old_settings = termios.tcgetattr(fd)
+        print(f"\n{BAR80}")
+        print(f"  📋 CURRENT FIRMWARE DETECTION RESULTS")
+        print(BAR80)
+        print(f"  • Firmware Type: {'MicroPython' if firmware_info['is_micropython'] else 'Other'}")
+        print(f"  • Version: {firmware_info['version']}")
+        print(f"  • Platform: {firmware_info['platform']}")
+        
+        if firmware_info['is_micropython']:
+            print(f"\n  ⚠️  MicroPython is already installed on this device!")
+            print(f"     This will overwrite your existing MicroPython installation.")
+            print(f"     Any files or programs stored on the device will be lost.")
+        else:
+            print(f"\n  ⚠️  Non-MicroPython firmware detected!")
+            print(f"     This will replace the current firmware with MicroPython.")
+            print(f"     Any existing programs or data will be lost.")
+        
+        print(f"\n  🔧 Raw Detection Output:")
+        print(f"  {DASH76}")
+        # Format the raw output with proper indentation
+        formatted_output = firmware_info['raw_output'].replace('\n', '\n  ')
+        print(f"  {formatted_output}")
+        print(f"  {DASH76}")
+        
+        print(f"\n{BAR80}")
+        print(f"  Do you want to overwrite the current firmware?")
+        print(BAR80)
+        
+        # Get user input
+        try:
+            choice = self.menu.select_option(options, 0, MENU_FOOTER_80)
+            if choice is None:  # 'q' or Ctrl+C
+                print("\nExiting...")
+                sys.exit(0)
                 
-                try:
-                    tty.setraw(sys.stdin.fileno())
-                    ch = sys.stdin.read(1)
-                    
-                    if ch == '\x1b':  # ESC sequence
-                        ch += sys.stdin.read(2)
-                    
-                finally:
-                    termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
-                
-                if ch == '\x1b[A':  # Up arrow
-                    current_index = (current_index - 1) % len(options)
-                    continue
-                elif ch == '\x1b[B':  # Down arrow
-                    current_index = (current_index + 1) % len(options)
-                    continue
-                elif ch == '\r' or ch == '\n':  # Enter
-                    choice = current_index
-                elif ch == 'q' or ch == '\x03':  # 'q' or Ctrl+C
-                    print("\nExiting...")
-                    sys.exit(0)
-                else:
-                    continue
-                    
-            except (ImportError, OSError):
-                # Fallback for systems without termios
+        except (ImportError, OSError):
+            # Fallback for systems without termios
+            while True:
                 try:
                     choice_input = input(f"\nSelect option (1-{len(options)}, 'q' to quit): ").strip()
                     if choice_input.lower() == 'q':
                         sys.exit(0)
                     choice = int(choice_input) - 1
-                    if choice < 0 or choice >= len(options):
-                        print(f"Please enter a number between 1 and {len(options)}")
-                        continue
+                    if 0 <= choice < len(options):
+                        break
+                    print(f"Please enter a number between 1 and {len(options)}")
                 except ValueError:
                     print("Please enter a valid number")
-                    continue
                 except KeyboardInterrupt:
                     print("\nExiting...")
                     sys.exit(0)
-            
-            if choice == 0:
-                return True
-            elif choice == 1:
-                print("\n👋 Keeping current firmware. Exiting...")
+        
+        if choice == 0:
+            return True
+        else:
+            print("\n👋 Keeping current firmware. Exiting...")
+            return False
+    
+    def _download_firmware(self, url, firmware_name):
+        """Stream a firmware binary to disk in chunks, showing download progress
+        
+        An existing local copy is revalidated with a conditional GET instead of being
+        downloaded again. Returns True if a new copy was downloaded, False if the local
+        copy is still current.
+        """
+        import requests
+        from email.utils import formatdate
+        
+        part_file = f"{firmware_name}.part"
+        etag_file = f"{firmware_name}.etag"
+        
+        headers = {}
+        if os.path.exists(firmware_name):
+            if os.path.exists(etag_file):
+                with open(etag_file) as f:
+                    headers['If-None-Match'] = f.read().strip()
+            headers['If-Modified-Since'] = formatdate(os.path.getmtime(firmware_name), usegmt=True)
+        
+        with requests.get(url, timeout=30, stream=True, headers=headers) as response:
+            if response.status_code == 304:
                 return False
+            
+            response.raise_for_status()
+            total = int(response.headers.get('Content-Length', 0))
+            downloaded = 0
+            
+            # Write to a temporary file so a failed download never leaves a truncated .bin behind
+            try:
+                with open(part_file, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        downloaded += len(chunk)
+                        print_progress(downloaded, total)
+                print()
+            except BaseException:
+                if os.path.exists(part_file):
+                    os.remove(part_file)
+                raise
+            
+            etag = response.headers.get('ETag')
+        
+        os.replace(part_file, firmware_name)
+        
+        # Remember the ETag so the next run can revalidate instead of downloading
+        if etag:
+            with open(etag_file, 'w') as f:
+                f.write(etag)
+        elif os.path.exists(etag_file):
+            os.remove(etag_file)
+        
+        return True
     
     def get_firmware_versions(self):
         """Get available MicroPython firmware versions"""
         print("\n🌐 Fetching available MicroPython firmware versions...")
         
         try:
-            # Define correct firmware URLs for each ESP32 variant
-            firmware_options = []
-            
-            if self.device_model == 'esp32c3':
-                firmware_options = [
-                    "ESP32_GENERIC_C3-20250911-v1.26.1.bin (Latest Stable)",
-                    "ESP32_GENERIC_C3-20241220-v1.26.1.bin (Previous Stable)",
-                    "ESP32_GENERIC_C3-20250911-v1.26.1.bin (Development)"
-                ]
-            elif self.device_model == 'esp32s3':
-                firmware_options = [
-                    "ESP32_GENERIC_S3-20250911-v1.26.1.bin (Latest Stable)",
-                    "ESP32_GENERIC_S3-20241220-v1.26.1.bin (Previous Stable)",
-                    "ESP32_GENERIC_S3-20250911-v1.26.1.bin (Development)"
-                ]
-            elif self.device_model == 'esp32c6':
-                firmware_options = [
-                    "ESP32_GENERIC_C6-20250911-v1.26.1.bin (Latest Stable)",
-                    "ESP32_GENERIC_C6-20241220-v1.26.1.bin (Previous Stable)",
-                    "ESP32_GENERIC_C6-20250911-v1.26.1.bin (Development)"
-                ]
-            else:  # esp32
-                firmware_options = [
-                    "ESP32_GENERIC-20250911-v1.26.1.bin (Latest Stable)",
-                    "ESP32_GENERIC-20241220-v1.26.1.bin (Previous Stable)",
-                    "ESP32_GENERIC-20250911-v1.26.1.bin (Development)"
-                ]
+            # Define correct firmware builds for each ESP32 variant
+            board = f"ESP32_GENERIC{FIRMWARE_BOARD_SUFFIXES.get(self.device_model, '')}"
+            firmware_options = [
+                f"{board}-{build_date}-{MICROPYTHON_VERSION}.bin ({label})"
+                for build_date, label in FIRMWARE_BUILDS
+            ]
             
             # Add option to use local file
             firmware_options.append("📁 Use local firmware file")
@@ -496,61 +693,54 @@ class ESPToolManager:
             
             if selected_index == len(firmware_options) - 1:
                 # Use local file
-                local_files = list(Path('.').glob('*.bin'))
+                local_files = sorted(entry.name for entry in os.scandir('.') if entry.is_file() and entry.name.endswith('.bin'))
                 if local_files:
-                    local_options = [str(f) for f in local_files]
-                    file_index = self.menu.display_menu("Select Local Firmware File", local_options)
-                    self.firmware_file = local_options[file_index]
+                    file_index = self.menu.display_menu("Select Local Firmware File", local_files)
+                    self.firmware_file = local_files[file_index]
                 else:
                     print("❌ No local .bin files found!")
                     return False
             else:
-                # Download firmware
+                # Download firmware - requests is only imported when a download is needed
+                import requests
+                
                 firmware_name = firmware_options[selected_index].split(' (')[0]
                 
                 # Use the correct URL structure for MicroPython firmware
-                if self.device_model == 'esp32c3':
-                    firmware_url = f"https://micropython.org/resources/firmware/{firmware_name}"
-                elif self.device_model == 'esp32s3':
-                    firmware_url = f"https://micropython.org/resources/firmware/{firmware_name}"
-                elif self.device_model == 'esp32c6':
-                    firmware_url = f"https://micropython.org/resources/firmware/{firmware_name}"
-                else:  # esp32
-                    firmware_url = f"https://micropython.org/resources/firmware/{firmware_name}"
+                firmware_url = f"https://micropython.org/resources/firmware/{firmware_name}"
                 
                 print(f"📥 Downloading {firmware_name}...")
                 print(f"🔗 URL: {firmware_url}")
                 
                 try:
-                    response = requests.get(firmware_url, timeout=30)
-                    response.raise_for_status()
-                    
+                    if self._download_firmware(firmware_url, firmware_name):
+                        print(f"✅ Downloaded: {firmware_name}")
+                    else:
+                        print(f"✅ Local copy is up to date: {firmware_name}")
                     self.firmware_file = firmware_name
-                    with open(self.firmware_file, 'wb') as f:
-                        f.write(response.content)
-                    
-                    print(f"✅ Downloaded: {firmware_name}")
                     
                 except requests.RequestException as e:
                     print(f"❌ Error downloading firmware: {e}")
                     print("Trying alternative download method...")
                     
                     # Try alternative URL structure
-                    alt_url = f"https://github.com/micropython/micropython/releases/download/v1.26.1/{firmware_name}"
+                    alt_url = f"https://github.com/micropython/micropython/releases/download/{MICROPYTHON_VERSION}/{firmware_name}"
                     try:
-                        response = requests.get(alt_url, timeout=30)
-                        response.raise_for_status()
-                        
+                        if self._download_firmware(alt_url, firmware_name):
+                            print(f"✅ Downloaded from alternative URL: {firmware_name}")
+                        else:
+                            print(f"✅ Local copy is up to date: {firmware_name}")
                         self.firmware_file = firmware_name
-                        with open(self.firmware_file, 'wb') as f:
-                            f.write(response.content)
-                        
-                        print(f"✅ Downloaded from alternative URL: {firmware_name}")
                         
                     except requests.RequestException as e2:
                         print(f"❌ Alternative download also failed: {e2}")
-                        print("Please download firmware manually or use local file option.")
-                        return False
+                        if os.path.exists(firmware_name):
+                            # Offline, but this firmware was downloaded on a previous run
+                            print(f"⚠️  Using previously downloaded copy: {firmware_name}")
+                            self.firmware_file = firmware_name
+                        else:
+                            print("Please download firmware manually or use local file option.")
+                            return False
             
             return True
             
@@ -559,9 +749,12 @@ class ESPToolManager:
             print("Using local firmware file if available...")
             
             # Check for existing local firmware
-            local_files = list(Path('.').glob(f"{self.device_model}*.bin"))
+            local_files = sorted(
+                entry.name for entry in os.scandir('.')
+                if entry.is_file() and entry.name.startswith(self.device_model) and entry.name.endswith('.bin')
+            )
             if local_files:
-                self.firmware_file = str(local_files[0])
+                self.firmware_file = local_files[0]
                 print(f"✅ Using existing local firmware: {self.firmware_file}")
                 return True
             else:
@@ -581,9 +774,10 @@ class ESPToolManager:
                 'erase-flash'
             ]
             
-            result = subprocess.run(erase_cmd, capture_output=True, text=True, timeout=30)
+            # esptool writes straight to the terminal so its progress shows live
+            result = subprocess.run(erase_cmd, timeout=30)
             if result.returncode != 0:
-                print(f"❌ Error erasing flash: {result.stderr}")
+                print(f"❌ Error erasing flash (esptool exit code {result.returncode})")
                 return False
             
             print("✅ Flash erased successfully")
@@ -597,16 +791,16 @@ class ESPToolManager:
                 'write-flash', '-z', '0x0', self.firmware_file
             ]
             
-            result = subprocess.run(flash_cmd, capture_output=True, text=True, timeout=60)
+            result = subprocess.run(flash_cmd, timeout=60)
             if result.returncode != 0:
-                print(f"❌ Error flashing firmware: {result.stderr}")
+                print(f"❌ Error flashing firmware (esptool exit code {result.returncode})")
                 print("Trying with slower baud rate...")
                 
                 # Try with slower baud rate
-                flash_cmd[4] = '115200'  # Change baud rate
-                result = subprocess.run(flash_cmd, capture_output=True, text=True, timeout=120)
+                flash_cmd[flash_cmd.index('--baud') + 1] = '115200'  # Change baud rate
+                result = subprocess.run(flash_cmd, timeout=120)
                 if result.returncode != 0:
-                    print(f"❌ Error flashing firmware: {result.stderr}")
+                    print(f"❌ Error flashing firmware (esptool exit code {result.returncode})")
                     return False
             
             print("✅ MicroPython flashed successfully!")
@@ -623,37 +817,30 @@ class ESPToolManager:
         """Test MicroPython connection"""
         print(f"\n🧪 Testing MicroPython connection on {self.device_port}...")
         
+        import serial
+        
         try:
-            # Try to connect with Python serial
-            test_cmd = [
-                'python', '-c', f'''
-import serial
-import time
-try:
-    ser = serial.Serial("{self.device_port}", 115200, timeout=2)
-    time.sleep(1)
-    ser.write(b"print(\\"Hello MicroPython!\\")\\r\\n")
-    time.sleep(1)
-    response = ser.read_all().decode("utf-8", errors="ignore")
-    ser.close()
-    if "Hello MicroPython!" in response:
-        print("✅ MicroPython connection successful!")
-        print("Response:", response.strip())
-    else:
-        print("❌ No response from MicroPython")
-        print("Response:", response.strip())
-except Exception as e:
-    print(f"❌ Connection test failed: {{e}}")
-'''
-            ]
-            
-            result = subprocess.run(test_cmd, capture_output=True, text=True, timeout=10)
-            print(result.stdout)
-            if result.stderr:
-                print(result.stderr)
+            ser = serial.Serial(self.device_port, 115200, timeout=CONNECTION_TEST_TIMEOUT)
+            try:
+                # The board was just reset by esptool and may still be booting
+                wait_for_repl(ser, CONNECTION_TEST_BOOT_TIMEOUT)
+                ser.write(CONNECTION_TEST_COMMAND)
+                # Returns as soon as the greeting arrives, or at the port timeout
+                response = ser.read_until(CONNECTION_TEST_REPLY, size=1024).decode('utf-8', errors='ignore')
+            finally:
+                ser.close()
+            
+            if CONNECTION_TEST_REPLY.decode() in response:
+                print("✅ MicroPython connection successful!")
+            else:
+                print("❌ No response from MicroPython")
+            print("Response:", response.strip())
             
             return True
             
+        except (serial.SerialException, OSError) as e:
+            print(f"❌ Connection test failed: {e}")
+            return False
         except Exception as e:
             print(f"❌ Error testing connection: {e}")
             return False